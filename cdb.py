@@ -1,9 +1,28 @@
 #!/usr/bin/env python
 
+import array
+import atexit
 import binascii
+import bisect
+import bz2
+import errno
+import fcntl
 import functools
+import gzip
+import heapq
 import inspect
 import io
+import json
+import mmap
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import threading
 import time
 import traceback
 import types
@@ -11,6 +30,7 @@ import sys
 import string
 import exceptions
 import collections
+import copy_reg
 
 from dis import dis
 from pprint import pformat as pf
@@ -122,6 +142,10 @@ def type_str(x):
         return "<%s>" % str(type(x))[8:-2]
     return "<%s>" % str(type(x))[1:-2]
 
+# record header: time and pid of the writer
+def time_stamp():
+    return time.strftime("%m.%d %H:%M:%S") + " [%d] =>" % os.getpid()
+
 # if string not printable, hexlify it
 def pstr(x):
     def not_printable(c):
@@ -131,36 +155,403 @@ def pstr(x):
         return binascii.hexlify(s)
     return s
 
+# compression of rotated segments: name -> (suffix, opener)
+Compressors = {'gzip': ('.gz',  gzip.open),
+               'bz2':  ('.bz2', bz2.BZ2File)}
+
+# rotated segments are <log>.1 (newest) .. <log>.N, maybe compressed
+SegmentName = re.compile(r'\.(\d+)(\.gz|\.bz2)?$')
+
+# <log>.<inode>.<pid>.tmp, a compression in progress
+StaleTmp = re.compile(r'\.\d+\.(\d+)\.tmp$')
+
+def log_segments(f_name):
+    """
+    existing segments of a log, oldest first, the live file last
+    """
+    d = os.path.dirname(f_name) or '.'
+    base = os.path.basename(f_name)
+    found = []
+    for name in os.listdir(d):
+        if not name.startswith(base + '.'):
+            continue
+        m = SegmentName.match(name, len(base))
+        if m:
+            found.append((-int(m.group(1)), os.path.join(d, name)))
+    rv = [path for i, path in sorted(found)]
+    if os.path.exists(f_name):
+        rv.append(f_name)
+    return rv
+
+# open a segment, compressed or not
+def open_log(path):
+    for suffix, opener in Compressors.values():
+        if path.endswith(suffix):
+            return opener(path, 'rb')
+    return open(path, 'rb')
+
+# append text with a single write(2) on an O_APPEND descriptor. On a
+# local file Linux keeps such an append whole whatever its size, unlike
+# a buffered file object, which splits it at the buffer size.
+# returns the file's inode if asked for it.
+def append_file(f_name, text, want_ino=False):
+    fd = os.open(f_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        n = os.write(fd, text)
+        while n < len(text):
+            # short write (disk full, signal), the rest follows
+            text = text[n:]
+            n = os.write(fd, text)
+        return os.fstat(fd).st_ino if want_ino else None
+    finally:
+        os.close(fd)
+
 class Writer(object):
     """
     Writer handles writes to a debugging file. Exists mainly to
-    store state (the file name)
+    store state (the file name, and an optional sink that records
+    go to instead, e.g. a SocketSink)
+
+    The file is rotated once it reaches max_bytes, or its first
+    record is max_age seconds old, keeping `backups` old segments
+    (<f_name>.1 is the newest), compressed in the background if
+    compress is 'gzip' or 'bz2'. The size is counted in process,
+    the file is only stat()ed when a rotation looks due.
     """
-    def __init__(self, f_name='/tmp/cdb'):
+    def __init__(self, f_name='/tmp/cdb', sink=None, max_bytes=0, max_age=0, backups=5, compress=None):
         self._f_name = f_name
+        self.sink = sink
+        if sink is not None and sink.fallback is None:
+            sink.fallback = f_name
+        if compress is not None and compress not in Compressors:
+            raise ValueError('compress must be one of %s' % ', '.join(Compressors))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._compressing = threading.Lock()
+        self._compressor = None
+        self._ino = None
+        self._written = 0
+        self._started = time.time()  # time of the segment's first record
+        if max_bytes or max_age:
+            self._restart()
+        if compress:
+            atexit.register(self._finish_compress)
+
+    # records are built up front and written with append_file, so
+    # concurrent writers don't interleave inside a record
+    def write_raw(self, text):
+        if self.sink is not None and self.sink.send(text):
+            return
+        rotating = self.max_bytes or self.max_age
+        ino = append_file(self._f_name, text, rotating and self._ino is None)
+        if rotating:
+            if self._ino is None:
+                # a new segment, maybe started by another writer
+                self._restart()
+            else:
+                self._written += len(text)
+            if self._due(self._written):
+                self.rotate()
+
+    def _due(self, size):
+        return bool((self.max_bytes and size >= self.max_bytes) or
+                    (self.max_age and time.time() - self._started >= self.max_age))
+
+    # start counting from the file as it is now
+    def _restart(self):
+        try:
+            st = os.stat(self._f_name)
+            self._ino, self._written = st.st_ino, st.st_size
+        except OSError:
+            self._ino, self._written = None, 0
+        self._started = self._first_record()
+
+    # time of the first record in the file (now if there is none),
+    # so a segment's age survives restarts and is the same for
+    # every process writing to it
+    def _first_record(self):
+        try:
+            with open(self._f_name, 'rb') as f:
+                m = RecordHead.match(f.read(256))
+        except IOError:
+            m = None
+        if m is None:
+            return time.time()
+        mon, day, h, mi, sec = [int(g) for g in m.groups()[:5]]
+        year = time.localtime().tm_year
+        t = time.mktime((year, mon, day, h, mi, sec, 0, 0, -1))
+        if t > time.time() + 86400:
+            # headers have no year: last december's
+            t = time.mktime((year - 1, mon, day, h, mi, sec, 0, 0, -1))
+        return t
+
+    def _segment(self, i, suffix=''):
+        return '%s.%d%s' % (self._f_name, i, suffix)
+
+    def _flock(self):
+        f = open(self._f_name + '.lock', 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def rotate(self, force=False):
+        with self._lock:
+            lock = self._flock()
+            try:
+                try:
+                    st = os.stat(self._f_name)
+                except OSError:
+                    self._restart()
+                    return
+                if not force:
+                    if st.st_ino != self._ino:
+                        # another writer rotated it already
+                        self._restart()
+                        return
+                    self._started = self._first_record()
+                    if not self._due(st.st_size):
+                        self._written = st.st_size
+                        return
+                suffixes = [''] + [sfx for sfx, opener in Compressors.values()]
+                for i in range(self.backups, 0, -1):
+                    for sfx in suffixes:
+                        for name in (self._segment(i, sfx), self._segment(i, sfx) + '.idx'):
+                            if not os.path.exists(name):
+                                continue
+                            if i == self.backups:
+                                os.unlink(name)
+                            else:
+                                os.rename(name, self._segment(i + 1, sfx) + name[len(self._segment(i, sfx)):])
+                for name in (self._f_name, self._f_name + '.idx'):
+                    if not os.path.exists(name):
+                        continue
+                    if self.backups:
+                        os.rename(name, self._segment(1) + name[len(self._f_name):])
+                    else:
+                        os.unlink(name)
+                self._ino, self._written, self._started = None, 0, time.time()
+            finally:
+                lock.close()
+        if self.compress and self.backups:
+            t = threading.Thread(target=self._compress_segments)
+            t.daemon = True
+            t.start()
+            self._compressor = t
+
+    # at exit, give a running compression compress_wait seconds to
+    # finish rather than leave a half written .tmp behind
+    compress_wait = 60
+
+    def _finish_compress(self):
+        t = self._compressor
+        if t is not None and t.is_alive():
+            t.join(self.compress_wait)
+
+    def _compress_segments(self):
+        """
+        compress every plain rotated segment. Segments may be shifted
+        by another rotation meanwhile, so each is found again by inode
+        before the compressed copy is put in its place.
+        """
+        with self._compressing:
+            self._compress_all()
+
+    # .tmp files left by compressions that died with their process
+    def _remove_stale(self):
+        d = os.path.dirname(self._f_name) or '.'
+        base = os.path.basename(self._f_name)
+        for name in os.listdir(d):
+            m = StaleTmp.match(name[len(base):]) if name.startswith(base + '.') else None
+            if m is None:
+                continue
+            pid = int(m.group(1))
+            if pid != os.getpid():
+                try:
+                    os.kill(pid, 0)
+                    continue
+                except OSError as e:
+                    if e.errno != errno.ESRCH:
+                        continue
+            try:
+                os.unlink(os.path.join(d, name))
+            except OSError:
+                pass
+
+    def _compress_all(self):
+        self._remove_stale()
+        sfx, opener = Compressors[self.compress]
+        for i in range(1, self.backups + 1):
+            try:
+                src = open(self._segment(i), 'rb')
+            except IOError:
+                continue
+            # src stays open till the swap, so its inode can't be reused
+            with src:
+                ino = os.fstat(src.fileno()).st_ino
+                tmp = '%s.%d.%d.tmp' % (self._f_name, ino, os.getpid())
+                try:
+                    with opener(tmp, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                except (IOError, OSError):
+                    continue
+                with self._lock:
+                    lock = self._flock()
+                    try:
+                        self._swap(src, ino, tmp, sfx)
+                    finally:
+                        lock.close()
+
+    def _swap(self, src, ino, tmp, sfx):
+        # a late writer may still have appended to it
+        done = src.tell() == os.fstat(src.fileno()).st_size
+        for j in range(1, self.backups + 1):
+            name = self._segment(j)
+            try:
+                if not done or os.stat(name).st_ino != ino:
+                    continue
+            except OSError:
+                continue
+            os.rename(tmp, self._segment(j, sfx))
+            os.unlink(name)
+            if os.path.exists(name + '.idx'):
+                os.unlink(name + '.idx')
+            return
+        # rotated away, done by another process, or still growing
+        os.unlink(tmp)
 
     def write_val(self, *args, **kwargs):
-        with open(self._f_name, 'a') as f:
-            f.write(col_time(time.strftime("%m.%d %H:%M:%S =>\n")))
-            for i, j in enumerate(args):
-                f.write(col_ind("  <%d>:" % i))
-                f.write(pstr(j) + NL)
-            for k, v in kwargs.items():
-                f.write(col_kw("  %s=" % k))
-                f.write(pstr(v) + NL)
-            f.write('\n')
+        rec = [col_time(time_stamp() + NL)]
+        for i, j in enumerate(args):
+            rec.append(col_ind("  <%d>:" % i))
+            rec.append(pstr(j) + NL)
+        for k, v in kwargs.items():
+            rec.append(col_kw("  %s=" % k))
+            rec.append(pstr(v) + NL)
+        rec.append(NL)
+        self.write_raw(''.join(rec))
 
     def write_dump(self, *args, **kwargs):
-        with open(self._f_name, 'a') as f:
-            f.write(col_time(time.strftime("%m.%d %H:%M:%S =>")))
-            for i in args:
-                f.write(i)
-            for k, v in kwargs.items():
-                f.write(k)
-
-                f.write('=>')
-                f.write(v)
-            f.write('\n')
+        rec = [col_time(time_stamp())]
+        for i in args:
+            rec.append(i)
+        for k, v in kwargs.items():
+            rec.append(k)
+            rec.append('=>')
+            rec.append(v)
+        rec.append(NL)
+        self.write_raw(''.join(rec))
+
+class SocketSink(object):
+    """
+    Ships records to a collector (python cdb.py collect) over a unix
+    socket. Never blocks the caller: unsent records wait in a bounded
+    buffer, and send() returns False when the collector is down or
+    the buffer is full, so the Writer falls back to its own file.
+    """
+    # frame header: time, pid, length of the record
+    FRAME = struct.Struct('!dII')
+
+    def __init__(self, address='/tmp/cdb.sock', max_buffer=1 << 20, retry=1.0, fallback=None):
+        self._address = address
+        self._max_buffer = max_buffer
+        self._retry = retry
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._sock = None
+        self._pid = os.getpid()
+        self._next_try = 0
+        self._frames = collections.deque()
+        self._buffered = 0
+        self._sent = 0  # bytes of _frames[0] already sent
+        atexit.register(self.close)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        # a half sent frame is dropped by the collector, start it over
+        self._sent = 0
+
+    def _connect(self):
+        now = time.time()
+        if now < self._next_try:
+            return False
+        self._next_try = now + self._retry
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        try:
+            sock.connect(self._address)
+        except socket.error:
+            sock.close()
+            return False
+        self._sock = sock
+        return True
+
+    def _flush(self):
+        while self._frames:
+            frame = self._frames[0]
+            try:
+                n = self._sock.send(buffer(frame, self._sent))
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    # collector gone: what it didn't take goes to the
+                    # file now, ahead of any later record
+                    self._disconnect()
+                    self._spill()
+                return
+            self._sent += n
+            if self._sent < len(frame):
+                return
+            self._frames.popleft()
+            self._buffered -= len(frame)
+            self._sent = 0
+
+    def send(self, text):
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: the connection and the buffer belong to the parent
+                self._sock = None
+                self._frames.clear()
+                self._buffered = self._sent = 0
+                self._pid = os.getpid()
+            if self._sock is None and not self._connect():
+                return False
+            frame = self.FRAME.pack(time.time(), self._pid, len(text)) + text
+            if self._buffered + len(frame) > self._max_buffer:
+                self._flush()
+                if self._buffered + len(frame) > self._max_buffer:
+                    return False
+            self._frames.append(frame)
+            self._buffered += len(frame)
+            self._flush()
+            return True
+
+    def close(self, timeout=0.5):
+        """
+        give the collector a moment to take what is buffered, and
+        write whatever is left to the fallback file
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            end = time.time() + timeout
+            while self._frames and time.time() < end:
+                if self._sock is None and not self._connect():
+                    break
+                self._flush()
+                if self._frames and self._sock is not None:
+                    select.select([], [self._sock], [], max(0, end - time.time()))
+            self._disconnect()
+            self._spill()
+
+    # write the buffered records to the fallback file, in order
+    def _spill(self):
+        if self._frames and self.fallback:
+            append_file(self.fallback, ''.join(frame[self.FRAME.size:] for frame in self._frames))
+        self._frames.clear()
+        self._buffered = 0
 
 # context manager to capture stdout of a function
 # that print but doesn't return a value.
@@ -211,6 +602,227 @@ def dec_ext(f, indt=0, showasm=0, showast=0, deob=0):
     return "\n".join(rv)
 
 
+##########################################
+# side effect free attribute access
+##########################################
+
+# a BaseException, so that it gets past `except Exception` in the
+# code it interrupts
+class AttrTimeout(BaseException):
+    def __init__(self, limit):
+        BaseException.__init__(self, 'over %gs' % limit.seconds)
+        self.limit = limit
+
+# bound the time spent on one attribute. Uses SIGALRM, so it only
+# works in the main thread, elsewhere it does nothing.
+#
+# use:
+# limit = TimeLimit(0.5)
+# with limit:
+#     slow()
+# if limit.timed_out: ...
+#
+# Limits nest: an inner limit ends no later than the outer one, and
+# when the outer one runs out its AttrTimeout goes past the inner
+# ones. A timer the application had set is put aside, still fires
+# on time, and is put back when the outermost limit ends.
+class TimeLimit:
+    active = []  # limits in force, innermost last
+    # the application's SIGALRM handler and timer
+    app = {'handler': None, 'due': None, 'interval': 0}
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = None
+        self.timed_out = False
+        self.error = None
+
+    def __enter__(self):
+        if (not self.seconds or not hasattr(signal, 'setitimer') or
+                not isinstance(threading.current_thread(), threading._MainThread)):
+            return self
+        now = time.time()
+        self.deadline = now + self.seconds
+        if TimeLimit.active:
+            self.deadline = min(self.deadline, TimeLimit.active[-1].deadline)
+        else:
+            delay, interval = signal.setitimer(signal.ITIMER_REAL, 0)
+            TimeLimit.app.update(due=now + delay if delay else None, interval=interval,
+                                 handler=signal.signal(signal.SIGALRM, TimeLimit.alarm))
+        TimeLimit.active.append(self)
+        TimeLimit.rearm()
+        return self
+
+    def __exit__(self, t, v, tb):
+        if self.deadline is None:
+            return False
+        TimeLimit.active.remove(self)
+        if TimeLimit.active:
+            TimeLimit.rearm()
+        else:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            app = TimeLimit.app
+            signal.signal(signal.SIGALRM, signal.SIG_DFL if app['handler'] is None else app['handler'])
+            if app['due'] is not None:
+                signal.setitimer(signal.ITIMER_REAL, max(app['due'] - time.time(), 1e-6), app['interval'])
+        if isinstance(v, AttrTimeout) and v.limit is self:
+            self.timed_out = True
+            self.error = v
+            return True
+        return False
+
+    @staticmethod
+    def rearm():
+        due = TimeLimit.active[-1].deadline
+        if TimeLimit.app['due'] is not None:
+            due = min(due, TimeLimit.app['due'])
+        signal.setitimer(signal.ITIMER_REAL, max(due - time.time(), 1e-6))
+
+    @staticmethod
+    def alarm(signum, frame):
+        now = time.time()
+        for limit in TimeLimit.active:
+            # outermost first
+            if now >= limit.deadline:
+                raise AttrTimeout(limit)
+        app = TimeLimit.app
+        if app['due'] is not None and now >= app['due']:
+            app['due'] = now + app['interval'] if app['interval'] else None
+            TimeLimit.rearm()
+            if callable(app['handler']):
+                app['handler'](signum, frame)
+            return
+        TimeLimit.rearm()
+
+# class attributes that are descriptors, but that are safe to show raw
+RawDescriptors = (types.FunctionType, types.BuiltinFunctionType, staticmethod, classmethod,
+                  type(object.__str__), type(str.join), type(dict.__dict__['fromkeys']))
+
+# data descriptors every object has, and that only read the object
+RawNames = ('__class__', '__dict__', '__weakref__')
+
+class Unevaluated(object):
+    """
+    stands in for an attribute that would run code to get
+    (a property or other descriptor), or that failed or ran
+    out of time when it was got
+    """
+    def __init__(self, kind, attr):
+        self.kind = kind
+        self.attr = attr
+
+    def __repr__(self):
+        if self.kind == 'unset':
+            return '<unset>'
+        if self.kind in ('exception', 'timeout'):
+            return '<%s %s: %s>' % (self.kind, type(self.attr).__name__, pstr(self.attr))
+        return '<%s %s, not evaluated>' % (self.kind, type(self.attr).__name__)
+    __str__ = __repr__
+
+def static_attr(x, name):
+    """
+    x.name without running properties, descriptors or __getattr__.
+    returns the raw value from __dict__ or a slot, the raw class
+    attribute, or an Unevaluated. raises AttributeError if the
+    name can only be found by running code.
+    """
+    if isinstance(x, (type, types.ClassType, types.ModuleType)):
+        owners = [x] if isinstance(x, types.ModuleType) else list(inspect.getmro(x))
+        for o in owners:
+            d = o.__dict__
+            if name in d:
+                return d[name]
+        raise AttributeError(name)
+
+    klass = x.__class__ if type(x) == types.InstanceType else type(x)
+    for c in inspect.getmro(klass):
+        if name in c.__dict__:
+            return static_instance_attr(x, name, c.__dict__[name])
+    return static_instance_attr(x, name, Unset)
+
+# static_attr for an instance whose class has cls_attr under name
+# (Unset if it has nothing)
+def static_instance_attr(x, name, cls_attr):
+    if type(x) == types.InstanceType:
+        klass, inst_dict = x.__class__, x.__dict__
+    else:
+        klass = type(x)
+        try:
+            inst_dict = object.__getattribute__(x, '__dict__')
+        except AttributeError:
+            inst_dict = {}
+
+    found = cls_attr is not Unset
+    if found:
+        tcls = type(cls_attr)
+        if hasattr(tcls, '__set__') or hasattr(tcls, '__delete__'):
+            # data descriptors win over the instance dict
+            if tcls == types.MemberDescriptorType or name in RawNames:
+                # __slots__ entry and the like, a plain read
+                return cls_attr.__get__(x, klass)
+            if isinstance(cls_attr, property):
+                return Unevaluated('property', cls_attr)
+            return Unevaluated('descriptor', cls_attr)
+    if name in inst_dict:
+        return inst_dict[name]
+    if not found:
+        raise AttributeError(name)
+    if hasattr(type(cls_attr), '__get__') and not isinstance(cls_attr, RawDescriptors):
+        return Unevaluated('descriptor', cls_attr)
+    return cls_attr
+
+# dir(x) without running code: no __dir__, no __getattr__ for
+# __members__/__methods__. The keys of x's own __dict__ and of the
+# __dict__ of every class in its mro (slots are in there too).
+def static_dir(x):
+    if isinstance(x, types.ModuleType):
+        return sorted(object.__getattribute__(x, '__dict__'))
+    if isinstance(x, (type, types.ClassType)):
+        owners = list(inspect.getmro(x))
+    elif type(x) == types.InstanceType:
+        owners = [x] + list(inspect.getmro(x.__class__))
+    else:
+        owners = list(inspect.getmro(type(x)))
+        try:
+            owners.insert(0, object.__getattribute__(x, '__dict__'))
+        except AttributeError:
+            pass
+    names = set()
+    for o in owners:
+        names.update(o if isinstance(o, dict) else o.__dict__)
+    return sorted(n for n in names if isinstance(n, str))
+
+# type_str without calling repr() on a classic instance
+def static_type_str(x):
+    if type(x) == types.InstanceType:
+        return '<%s.%s>' % (x.__class__.__module__, x.__class__.__name__)
+    return type_str(x)
+
+# (name, value) for dir(x), like inspect.getmembers but optionally
+# without running code, and with a time budget per attribute.
+# values that fail come back as an Unevaluated.
+def safe_members(x, safe=True, budget=None, names=None):
+    if names is None:
+        try:
+            names = static_dir(x) if safe else dir(x)
+        except Exception:
+            names = []
+    rv = []
+    for name in names:
+        limit = TimeLimit(budget)
+        try:
+            with limit:
+                val = static_attr(x, name) if safe else getattr(x, name)
+        except AttributeError:
+            continue
+        except Exception as e:
+            val = Unevaluated('exception', e)
+        if limit.timed_out:
+            val = Unevaluated('timeout', limit.error)
+        rv.append((name, val))
+    return rv
+
+
 # wrapper to deal with recursion depth
 # also returns on any exception
 def depth_dec(f):
@@ -224,6 +836,11 @@ def depth_dec(f):
             return col_err('Max Depth!!\n')
         try:
             rv = f(self, obj, **kwargs)
+        except AttrTimeout:
+            # let it reach the attribute that ran out of time
+            if inc:
+                self.depth -= 1
+            raise
         except:
             return col_err('Exception\n')
         if inc:
@@ -244,6 +861,9 @@ class ObjectDumper(object):
         self.deep=2
         self.f_introspect = 0 # set the level of function introspections
         self.all_members = False # set to True to get __* members
+        self.safe = False # don't run properties/descriptors of instances
+        self.attr_budget = None # seconds per instance attribute
+        self.max_members = None # members shown per instance
 
     # indent
     @property
@@ -316,6 +936,9 @@ class ObjectDumper(object):
         if ty in SimplePrint:
             return ind + col_simp(type_str(obj) + ":"+ col_none(repr(obj))) + nl
 
+        if ty == Unevaluated:
+            return ind + col_simp(repr(obj)) + nl
+
         rv = ind + col_simp(type_str(obj)) + ":"
 
         # check types
@@ -403,16 +1026,7 @@ class ObjectDumper(object):
             pass
 
         if inspect.isclass(object):
-            rv += NL + self.ind + "----------------------" + NL
-            members = inspect.getmembers(obj)
-
-            for name, val in members:
-                if not self.all_members and name.startswith('__'):
-                    continue
-                rv += self.ind + subi + col_mem(name) + self.spacing(len(name)) + '=>'
-                rv += col_obj(self.dump_obj(val, lead=True))
-            rv += self.ind + "----------------------" +NL
-            return rv
+            return rv + self.dump_members(obj)
 
         #########################
         # methods, functions, etc
@@ -552,14 +1166,27 @@ class ObjectDumper(object):
 
         #default case
         # most likely a class instance
-        rv += NL + self.ind + "----------------------" + NL
-        members = inspect.getmembers(obj)
+        return rv + self.dump_members(obj)
 
-        for name, val in members:
-            if not self.all_members and name.startswith('__'):
-                continue
+    # members of a class or instance, one per line
+    def dump_members(self, obj):
+        subi = self.subi
+        rv = NL + self.ind + "----------------------" + NL
+        names = static_dir(obj) if self.safe else dir(obj)
+        names = [n for n in names if self.all_members or not n.startswith('__')]
+        more = 0
+        if self.max_members is not None and len(names) > self.max_members:
+            more = len(names) - self.max_members
+            names = names[:self.max_members]
+
+        for name, val in safe_members(obj, self.safe, self.attr_budget, names):
             rv += self.ind + subi + col_mem(name) + self.spacing(len(name)) + '=>'
-            rv += col_obj(self.dump_obj(val, lead=True))
+            limit = TimeLimit(self.attr_budget)
+            with limit:
+                out = col_obj(self.dump_obj(val, lead=True))
+            rv += col_err('Timeout\n') if limit.timed_out else out
+        if more:
+            rv += self.ind + subi + '... %d more\n' % more
         rv += self.ind + "----------------------" +NL
         return rv
 
@@ -568,6 +1195,164 @@ class ObjectDumper(object):
         self.depth = -1
         return self.dump_obj(obj)
 
+####################################
+#
+#  attribute watchpoints
+#
+####################################
+
+# attribute not set
+Unset = Unevaluated('unset', None)
+
+# compact "file:line func" stack, innermost first
+def short_stack(frame, limit):
+    lines = traceback.extract_stack(frame, limit)
+    return ' <- '.join('%s:%d %s' % (os.path.basename(f_name), line, func)
+                       for f_name, line, func, stmt in reversed(lines))
+
+class WatchedAttr(object):
+    """
+    Data descriptor put in front of a watched attribute. Gets go
+    to the original attribute (instance dict, slot, property...),
+    sets and deletes do too, and are logged through a DBPrinter.
+    """
+    def __init__(self, name, orig, printer, stack):
+        self.name = name
+        self.orig = orig  # what the class had under name, or Unset
+        self.printer = printer
+        self.stack = stack
+        self.data = hasattr(type(orig), '__set__')
+
+    def peek(self, obj):
+        # current value, without running a property or descriptor
+        try:
+            return static_instance_attr(obj, self.name, self.orig)
+        except AttributeError:
+            return Unset
+
+    def __get__(self, obj, klass=None):
+        if obj is None:
+            # looked up on the class: give what the class had
+            if self.orig is Unset:
+                raise AttributeError("type object '%s' has no attribute '%s'" % (klass.__name__, self.name))
+            if hasattr(type(self.orig), '__get__'):
+                return self.orig.__get__(None, klass)
+            return self.orig
+        if self.data:
+            return self.orig.__get__(obj, klass)
+        d = getattr(obj, '__dict__', {})
+        if self.name in d:
+            return d[self.name]
+        if self.orig is Unset:
+            raise AttributeError("'%s' object has no attribute '%s'" % (klass.__name__, self.name))
+        if hasattr(type(self.orig), '__get__'):
+            return self.orig.__get__(obj, klass)
+        return self.orig
+
+    def __set__(self, obj, value):
+        old = self.peek(obj)
+        if self.data:
+            self.orig.__set__(obj, value)
+        else:
+            obj.__dict__[self.name] = value
+        self.log(obj, 'set', old, value, sys._getframe(1))
+
+    def __delete__(self, obj):
+        old = self.peek(obj)
+        if self.data:
+            self.orig.__delete__(obj)
+        else:
+            try:
+                del obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name)
+        self.log(obj, 'del', old, Unset, sys._getframe(1))
+
+    def log(self, obj, what, old, new, frame):
+        dumper = self.printer.watch_dumper
+        klass = obj.__class__
+        klass = klass.__dict__.get('_cdb_base', klass)
+        where = col_fun('{{%s.%s}}' % (klass.__name__, self.name))
+        self.printer.writer.write_dump(
+            ' watch %s %s @0x%x\n' % (where, what, id(obj)),
+            col_stk('  %s\n' % short_stack(frame, self.stack)),
+            col_kw('  old: '), dumper.dwrap(old),
+            col_kw('  new: '), dumper.dwrap(new))
+
+# __setattr__/__delattr__ shims for classic instances, which ignore
+# data descriptors
+def classic_setattr(self, name, value):
+    w = self._cdb_watches.get(name)
+    old = w.peek(self) if w else None
+    base_set = getattr(self._cdb_base, '__setattr__', None)
+    if base_set is not None:
+        base_set(self, name, value)
+    else:
+        self.__dict__[name] = value
+    if w:
+        w.log(self, 'set', old, value, sys._getframe(1))
+
+def classic_delattr(self, name):
+    w = self._cdb_watches.get(name)
+    old = w.peek(self) if w else None
+    base_del = getattr(self._cdb_base, '__delattr__', None)
+    if base_del is not None:
+        base_del(self, name)
+    else:
+        del self.__dict__[name]
+    if w:
+        w.log(self, 'del', old, Unset, sys._getframe(1))
+
+# pickle and copy a watched object as its original class
+def watched_reduce_ex(self, protocol):
+    klass = self.__class__
+    base = klass._cdb_base
+    rv = base.__reduce_ex__(self, protocol)
+    if not isinstance(rv, tuple) or len(rv) < 2:
+        return rv
+    if rv[0] is copy_reg.__newobj__:
+        # pickle insists __newobj__ gets obj.__class__, go around it
+        return (watched_new, (base,) + tuple(rv[1][1:])) + rv[2:]
+    return (rv[0], tuple(base if a is klass else a for a in rv[1])) + rv[2:]
+
+# unpickles a watched object as its original class
+def watched_new(base, *args):
+    return base.__new__(base, *args)
+
+# a private subclass for one watched object, so nothing else pays
+# for the watch. Same name and layout as the original class, and
+# isinstance() still holds, but `type(obj) is Base` doesn't while the
+# object is watched. Classic instances can't be pickled meanwhile.
+def watch_class(obj):
+    if type(obj) == types.InstanceType:
+        base = obj.__class__
+        if '_cdb_base' in base.__dict__:
+            return base
+        sub = types.ClassType(base.__name__, (base,),
+                              {'_cdb_base': base, '_cdb_watches': {}, '__module__': base.__module__,
+                               '__setattr__': classic_setattr, '__delattr__': classic_delattr})
+    else:
+        base = type(obj)
+        if '_cdb_base' in base.__dict__:
+            return base
+        sub = type(base)(base.__name__, (base,),
+                         {'_cdb_base': base, '_cdb_watches': {}, '__module__': base.__module__,
+                          '__slots__': (), '__reduce_ex__': watched_reduce_ex})
+    try:
+        obj.__class__ = sub
+    except TypeError as e:
+        raise TypeError("can't watch %s instances: %s" % (base.__name__, e))
+    return sub
+
+# class wide watches: (class, name) -> (what the class itself had, WatchedAttr)
+ClassWatches = {}
+
+def find_class_attr(klass, name):
+    for c in inspect.getmro(klass):
+        if name in c.__dict__:
+            return c.__dict__[name]
+    return Unset
+
 ####################################
 #
 #  Improved/Simplified clone of q.py
@@ -575,12 +1360,17 @@ class ObjectDumper(object):
 ####################################
 
 class DBPrinter(object):
-    def __init__(self, f_name='/tmp/cdb'):
+    def __init__(self, f_name='/tmp/cdb', sink=None, **rotation):
         self._f_name = f_name
-        self.writer = Writer(f_name)
+        self.writer = Writer(f_name, sink, **rotation)
         self.dumper = ObjectDumper()
         self.dumper.max_depth = 3
         self.deep = 1
+        # old/new values of watched attributes
+        self.watch_dumper = ObjectDumper()
+        self.watch_dumper.max_depth = 2
+        self.watch_dumper.safe = True
+        self.watch_dumper.max_members = 20
 
     # decorator:  mark when function called, args, and return vals
     def cdb_dec(self, f):
@@ -618,20 +1408,67 @@ class DBPrinter(object):
         self.writer.write_dump(self.dumper.dwrap(other))
         return other
 
+    # log every set/del of obj.name with old and new values and the
+    # `stack` innermost callers. obj can be an instance (only it is
+    # affected) or a new-style class (all of its instances). A watched
+    # instance is moved to a private subclass, see watch_class.
+    def watch(self, obj, name, stack=4):
+        if isinstance(obj, type):
+            if (obj, name) in ClassWatches:
+                if obj.__dict__.get(name) is ClassWatches[obj, name][1]:
+                    return
+                # replaced by an assignment to the class: watch the new one
+                del ClassWatches[obj, name]
+            own = obj.__dict__.get(name, Unset)
+            w = WatchedAttr(name, find_class_attr(obj, name), self, stack)
+            setattr(obj, name, w)
+            ClassWatches[obj, name] = own, w
+            return
+        if isinstance(obj, types.ClassType):
+            raise TypeError("can't watch a classic class, watch its instances")
+        klass = watch_class(obj)
+        w = WatchedAttr(name, find_class_attr(klass._cdb_base, name), self, stack)
+        klass._cdb_watches[name] = w
+        if type(obj) != types.InstanceType:
+            setattr(klass, name, w)
+
+    # stop watching obj.name, or all of obj's attributes, and put
+    # the class back the way it was
+    def unwatch(self, obj, name=None):
+        if isinstance(obj, type):
+            for klass, n in ClassWatches.keys():
+                if klass is obj and name in (None, n):
+                    own, w = ClassWatches.pop((klass, n))
+                    if klass.__dict__.get(n) is not w:
+                        # assigned to during the watch, keep that
+                        self.writer.write_val('unwatch: %s.%s was reassigned, left as is' % (klass.__name__, n))
+                    elif own is Unset:
+                        delattr(klass, n)
+                    else:
+                        setattr(klass, n, own)
+            return
+        klass = obj.__class__
+        if '_cdb_base' not in klass.__dict__:
+            return
+        for n in ([name] if name else klass._cdb_watches.keys()):
+            if klass._cdb_watches.pop(n, None) and n in klass.__dict__:
+                delattr(klass, n)
+        if not klass._cdb_watches:
+            obj.__class__ = klass._cdb_base
+
     # dump traceback
     def __pos__(self):
-        with open('/tmp/cdb', 'a') as f:
-            f.write(col_time(time.strftime("%m.%d %H:%M:%S =>")))
-            f.write(' - \n')
-            lines = traceback.extract_stack()
-            lines = lines[:-1]
-            for f_name, line, func, stmt in lines:
-                #ignore our decorator
-                if pstr(func) == 'cdb_rfunc':
-                    continue
-                f.write(col_stk("\t%s:%s in %s -- " % (repr(f_name), repr(line), repr(func))))
-                f.write(repr(stmt))
-                f.write('\n')
+        rec = [col_time(time_stamp()), ' - \n']
+        lines = traceback.extract_stack()
+        lines = lines[:-1]
+        for f_name, line, func, stmt in lines:
+            #ignore our decorator
+            if pstr(func) == 'cdb_rfunc':
+                continue
+            rec.append(col_stk("\t%s:%s in %s -- " % (repr(f_name), repr(line), repr(func))))
+            rec.append(repr(stmt))
+            rec.append('\n')
+        self.writer.write_raw(''.join(rec))
 
 # cb: the default debug printer
 cb = DBPrinter()
@@ -660,21 +1497,27 @@ def pod(*x, **y):
             print glod.dwrap(v)
 
 # extended pod
-def podx(obj, tag=0, all_members=False, f_intro=0, deep=2, maxd=20):
+def podx(obj, tag=0, all_members=False, f_intro=0, deep=2, maxd=20, safe=False, budget=None, max_members=None):
     """
-    podx(obj, tag=0, all_members=False, f_intro=0, deep=2, maxd=20)
+    podx(obj, tag=0, all_members=False, f_intro=0, deep=2, maxd=20, safe=False, budget=None, max_members=None)
     :param obj: object
     :param tag: a label
     :param all_members: boolean (include __ names)
     :param f_intro:  function introspection 1,2,4
     :param deep: int (depth of deep inspections)
     :param maxd: int (depth of recursion)
+    :param safe: boolean (don't evaluate properties/descriptors)
+    :param budget: float (seconds per attribute)
+    :param max_members: int (members shown per instance)
     :return: nothing
     """
     od = ObjectDumper()
     od.all_members = all_members
     od.f_introspect = f_intro
     od.deep = deep
+    od.safe = safe
+    od.attr_budget = budget
+    od.max_members = max_members
     print col_tag(tag)
     print od.dwrap(obj)
 
@@ -702,22 +1545,39 @@ def podla(*x, **y):
             print glod_long.dwrap(v)
 
 # extended dir
-def edir(x):
+def edir(x, safe=False, budget=None, page=1, per_page=0):
     if type(x) == types.DictionaryType:
         ddir(x)
         return
     if type(x) in IterableTypes:
         idir(x)
         return
-    ldir(x)
-
-def ldir(x):
-    print "%s:%s" % (col_key(type_str(x)), pstr(x))
-    for name in dir(x):
-        if name == '__builtins__':
-            continue
-        obj = getattr(x, name)
-        print "  ", col_mem(name), " " * (30 - len(name)), "%s:%s" % (col_key(type_str(obj)), col_none(pstr(obj)))
+    ldir(x, safe, budget, page, per_page)
+
+# safe: don't run properties/descriptors, budget: seconds per attribute,
+# page/per_page: only look at one page of dir(x)
+def ldir(x, safe=False, budget=None, page=1, per_page=0):
+    if safe:
+        # str(x) could run anything
+        print "%s at 0x%x" % (col_key(static_type_str(x)), id(x))
+    else:
+        print "%s:%s" % (col_key(type_str(x)), pstr(x))
+    names = [n for n in (static_dir(x) if safe else dir(x)) if n != '__builtins__']
+    if per_page:
+        pages = max(1, (len(names) + per_page - 1) // per_page)
+        page = page if page > 0 else pages + page + 1
+        print "  page %d/%d of %d attributes" % (page, pages, len(names))
+        names = names[(page - 1) * per_page:page * per_page]
+    for name, obj in safe_members(x, safe, budget, names):
+        limit = TimeLimit(budget)
+        with limit:
+            if isinstance(obj, Unevaluated):
+                val = col_none(obj)
+            else:
+                val = "%s:%s" % (col_key(type_str(obj)), col_none(pstr(obj)))
+        if limit.timed_out:
+            val = col_err('timeout %s' % limit.error)
+        print "  ", col_mem(name), " " * (30 - len(name)), val
 
 def ddir(x):
     print "%s" % (col_key(type_str(x)))
@@ -731,6 +1591,539 @@ def idir(x):
     for v in x:
         print "  ", "%s:%s" % (col_key(type_str(v)), col_none(pstr(v)))
 
+####################################
+#
+#  log viewer
+#
+####################################
+
+# any run of color escapes
+ESC = r'(?:\033\[[0-9;]*m)*'
+
+# start of a record: "mm.dd HH:MM:SS [pid] =>", pid missing in old logs
+RecordHead = re.compile(r'^' + ESC + r'(\d\d)\.(\d\d) (\d\d):(\d\d):(\d\d)(?: \[(\d+)\])? =>', re.M)
+
+# first two values of a cdb_dec record: tag, then [in->|out->]{{module.func}}
+RecordTag = re.compile(r'[^\n]*\n' + ESC + r'  <0>:' + ESC + r'(\d+)\n' +
+                       ESC + r'  <1>:' + ESC + r'(in->|out->)?' + ESC + r'\{\{([^}\n]*)\}\}')
+
+EscCodes = re.compile(r'\033\[[0-9;]*m')
+
+# record kinds
+K_PLAIN, K_IN, K_OUT, K_EXC = range(4)
+
+# "mm.dd HH:MM:SS" as a sortable int (no year in the log)
+def time_key(mon, day, h, m, s):
+    return ((mon * 32 + day) * 86400) + h * 3600 + m * 60 + s
+
+# parse "mm.dd HH:MM:SS", "mm.dd" or "HH:MM:SS" (today)
+def parse_time_key(s):
+    now = time.localtime()
+    for fmt in ("%m.%d %H:%M:%S", "%m.%d %H:%M", "%m.%d", "%H:%M:%S", "%H:%M"):
+        try:
+            t = time.strptime(s, fmt)
+        except ValueError:
+            continue
+        mon, day = (t.tm_mon, t.tm_mday) if '.' in fmt else (now.tm_mon, now.tm_mday)
+        return time_key(mon, day, t.tm_hour, t.tm_min, t.tm_sec)
+    raise ValueError('bad time: %r' % s)
+
+class LogIndex(object):
+    """
+    Offsets of the records in a cdb log, kept in a sidecar file
+    (<log>.idx) and extended incrementally as the log grows.
+    Records are numbered in file order; tags, funcs and pids map
+    to lists of record numbers. The in and out records of a
+    cdb_dec call are paired as they are indexed: tags repeat, so
+    an out record closes the innermost open in record with the
+    same pid, function and tag.
+    """
+    VERSION = 3
+    ARRAYS = ('offsets', 'times', 'kinds', 'pairs')
+    TABLES = ('tags', 'funcs', 'pids', 'open')
+
+    def __init__(self, f_name):
+        self._idx_name = f_name + '.idx'
+        self.reset()
+
+    def reset(self):
+        self.ino     = None
+        self.size    = 0
+        self.check   = 0  # see _check
+        self.offsets = array.array('L')  # record start
+        self.times   = array.array('l')  # time_key of the header
+        self.kinds   = array.array('b')  # K_*
+        self.pairs   = array.array('l')  # other half of a cdb_dec call or -1
+        self.tags    = {}
+        self.funcs   = {}
+        self.pids    = {}
+        self.open    = {}  # (pid, func, tag) -> stack of unpaired in records
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # <log>.idx is a line of json (the scalars and the dicts, as
+    # lists of pairs) followed by the four arrays, raw. Nothing in it
+    # is code, and one left in /tmp by another user is not read.
+    def load(self):
+        try:
+            with open(self._idx_name, 'rb') as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    return
+                head = json.loads(f.readline())
+                if head.get('version') != self.VERSION:
+                    return
+                n = head['n']
+                arrays = []
+                for k in self.ARRAYS:
+                    a = array.array(getattr(self, k).typecode)
+                    if head['itemsizes'][k] != a.itemsize:
+                        return
+                    a.fromfile(f, n)
+                    arrays.append(a)
+                # json gives back lists for tuples and unicode for str
+                tags = dict(head['tags'])
+                funcs = dict((str(k), v) for k, v in head['funcs'])
+                pids = dict(head['pids'])
+                opened = dict(((p, str(fn), t), v) for (p, fn, t), v in head['open'])
+        except Exception:
+            return
+        self.ino, self.size, self.check = head['ino'], head['size'], head['check']
+        self.offsets, self.times, self.kinds, self.pairs = arrays
+        self.tags, self.funcs, self.pids, self.open = tags, funcs, pids, opened
+
+    def save(self):
+        head = {'version': self.VERSION, 'ino': self.ino, 'size': self.size,
+                'check': self.check, 'n': len(self.offsets),
+                'itemsizes': dict((k, getattr(self, k).itemsize) for k in self.ARRAYS)}
+        for t in self.TABLES:
+            head[t] = getattr(self, t).items()
+        tmp = '%s.%d' % (self._idx_name, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(head, separators=(',', ':')) + '\n')
+                for k in self.ARRAYS:
+                    getattr(self, k).tofile(f)
+            os.rename(tmp, self._idx_name)
+        except (IOError, OSError, ValueError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _check(self, buf):
+        # crc of the first and the last indexed header. An append only
+        # log keeps them; a log truncated in place and written again
+        # past its old size (same inode, bigger) almost surely doesn't
+        last = self.offsets[-1] if self.offsets else 0
+        crc = binascii.crc32(buf[0:min(64, self.size)])
+        return binascii.crc32(buf[last:min(last + 64, self.size)], crc)
+
+    def _pop(self, buf):
+        # the log is append only, so the last record still parses
+        # the same way and tells us which lists it is on. False if
+        # it doesn't: the log was rewritten
+        n = len(self.offsets) - 1
+        start = self.offsets[n]
+        m = RecordHead.match(buf, start)
+        if m is None:
+            return False
+        pid = m.group(6)
+        t = RecordTag.match(buf, start)
+        for table, key in ((self.pids, pid and int(pid)),
+                           (self.tags, t and int(t.group(1))),
+                           (self.funcs, t and t.group(3))):
+            v = table.get(key)
+            if v and v[-1] == n:
+                v.pop()
+                if not v:
+                    del table[key]
+        if t is not None:
+            key = (pid and int(pid), t.group(3), int(t.group(1)))
+            if self.kinds[n] == K_IN:
+                self.open[key].pop()
+                if not self.open[key]:
+                    del self.open[key]
+            elif self.pairs[n] >= 0:
+                # reopen the in record it closed
+                self.pairs[self.pairs[n]] = -1
+                self.open.setdefault(key, []).append(self.pairs[n])
+        for a in (self.offsets, self.times, self.kinds, self.pairs):
+            a.pop()
+        return True
+
+    def update(self, buf, ino):
+        """
+        index whatever was appended to buf since the last update.
+        the last record may have been cut short, so it is redone.
+        returns True if the log was replaced and indexed from scratch.
+        """
+        size = len(buf)
+        fresh = ino != self.ino or size < self.size or self._check(buf) != self.check
+        if fresh:
+            self.reset()
+        self.ino = ino
+        if size == self.size:
+            return fresh
+        pos = 0
+        if self.offsets:
+            pos = self.offsets[-1]
+            if not self._pop(buf):
+                self.reset()
+                self.ino = ino
+                pos, fresh = 0, True
+        for m in RecordHead.finditer(buf, pos):
+            self._add(buf, m)
+        self.size = size
+        self.check = self._check(buf)
+        return fresh
+
+    def _add(self, buf, m):
+        n = len(self.offsets)
+        mon, day, h, mi, sec, pid = m.groups()
+        self.offsets.append(m.start())
+        self.times.append(time_key(int(mon), int(day), int(h), int(mi), int(sec)))
+        if pid is not None:
+            pid = int(pid)
+            self.pids.setdefault(pid, []).append(n)
+
+        t = RecordTag.match(buf, m.start())
+        if t is None:
+            self.kinds.append(K_PLAIN)
+            self.pairs.append(-1)
+            return
+        tag, way, func = int(t.group(1)), t.group(2), t.group(3)
+        kind = {'in->': K_IN, 'out->': K_OUT}.get(way, K_EXC)
+        self.kinds.append(kind)
+        self.tags.setdefault(tag, []).append(n)
+        self.funcs.setdefault(func, []).append(n)
+
+        key = (pid, func, tag)
+        if kind == K_IN:
+            self.pairs.append(-1)
+            self.open.setdefault(key, []).append(n)
+            return
+        stack = self.open.get(key)
+        if not stack:
+            self.pairs.append(-1)
+            return
+        i = stack.pop()
+        if not stack:
+            del self.open[key]
+        self.pairs[i] = n
+        self.pairs.append(i)
+
+    def pair(self, n):
+        """
+        record number of the other half of a cdb_dec call, or None
+        """
+        i = self.pairs[n]
+        return i if i >= 0 else None
+
+class LogView(object):
+    """
+    memory mapped cdb log plus its index. Compressed (rotated)
+    segments are inflated into a temporary file when a record is
+    first needed; their index is kept like any other.
+    The sidecar index is written after the first build, then at
+    most every save_every seconds, and on close().
+    """
+    save_every = 30
+
+    def __init__(self, f_name='/tmp/cdb', use_index=True):
+        self._f_name = f_name
+        self._use_index = use_index
+        self._dirty = False
+        self._saved_at = 0
+        self._compressed = any(f_name.endswith(sfx) for sfx, opener in Compressors.values())
+        self.index = LogIndex(f_name)
+        if use_index:
+            self.index.load()
+        self._file = None
+        self.buf = ''
+        self.refresh()
+
+    def _inflate(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+            with open_log(self._f_name) as src:
+                shutil.copyfileobj(src, self._file, 1 << 20)
+            self._file.flush()
+            size = os.fstat(self._file.fileno()).st_size
+            self.buf = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else ''
+        return self.buf
+
+    def refresh(self):
+        """
+        remap the log if it grew (or was replaced), and index the new part.
+        returns the number of the first new record.
+        """
+        old = len(self.index)
+        try:
+            st = os.stat(self._f_name)
+        except OSError:
+            return old
+        if self._compressed:
+            # never grows
+            if st.st_ino != self.index.ino:
+                self.index.update(self._inflate(), st.st_ino)
+                self._dirty = True
+                self.save()
+            return old
+        if st.st_ino != self.index.ino or st.st_size < self.index.size:
+            old = 0
+        if self._file is None or old == 0 or st.st_size != len(self.buf):
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._f_name, 'rb')
+            size = os.fstat(self._file.fileno()).st_size
+            self.buf = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else ''
+            if self.index.update(self.buf, st.st_ino):
+                old = 0
+            self._dirty = True
+            self.save()
+        return min(old, len(self.index))
+
+    def save(self, force=False):
+        if not (self._use_index and self._dirty):
+            return
+        if force or time.time() - self._saved_at >= self.save_every:
+            self.index.save()
+            self._dirty = False
+            self._saved_at = time.time()
+
+    def record(self, n):
+        if self._compressed:
+            self._inflate()
+        start = self.index.offsets[n]
+        end = self.index.offsets[n + 1] if n + 1 < len(self.index) else len(self.buf)
+        return self.buf[start:end]
+
+    def _funcs(self, func):
+        # 'func' matches 'module.func'
+        return [k for k in self.index.funcs if k == func or k.endswith('.' + func)]
+
+    def select(self, tag=None, func=None, pid=None, since=None, until=None, grep=None, start=0):
+        """
+        record numbers >= start matching all of the given filters
+        """
+        idx = self.index
+        keyed = []
+        if tag is not None:
+            keyed.append(idx.tags.get(tag, []))
+        if func is not None:
+            keyed.append(sorted(set(i for k in self._funcs(func) for i in idx.funcs[k])))
+        if pid is not None:
+            keyed.append(idx.pids.get(pid, []))
+        cands = None
+        for hits in sorted(keyed, key=len):
+            cands = set(hits) if cands is None else cands.intersection(hits)
+        if cands is None:
+            lo = start
+            hi = len(idx)
+            if since is not None:
+                lo = max(lo, bisect.bisect_left(idx.times, since))
+            if until is not None:
+                hi = bisect.bisect_right(idx.times, until)
+            cands = xrange(lo, hi)
+        else:
+            cands = [i for i in sorted(cands) if i >= start and
+                     (since is None or idx.times[i] >= since) and
+                     (until is None or idx.times[i] <= until)]
+        if grep is not None:
+            cands = [i for i in cands if grep.search(self.record(i))]
+        return list(cands)
+
+    def with_pairs(self, recs):
+        seen = set()
+        rv = []
+        for n in recs:
+            for i in sorted((n, self.index.pair(n))):
+                if i is not None and i not in seen:
+                    seen.add(i)
+                    rv.append(i)
+        return rv
+
+    def close(self):
+        self.save(force=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def view_main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(prog='cdb.py view', description='view a cdb log')
+    ap.add_argument('log', nargs='?', default='/tmp/cdb')
+    ap.add_argument('-a', '--all', action='store_true', help='include rotated segments, compressed or not')
+    ap.add_argument('-t', '--tag', type=int, help='cdb_dec call tag')
+    ap.add_argument('-F', '--func', help='decorated function, module.func or func')
+    ap.add_argument('-p', '--pid', type=int)
+    ap.add_argument('-s', '--since', type=parse_time_key, help='mm.dd HH:MM:SS or HH:MM:SS')
+    ap.add_argument('-u', '--until', type=parse_time_key)
+    ap.add_argument('-g', '--grep', type=re.compile, help='regex over the raw record')
+    ap.add_argument('-P', '--pair', action='store_true', help='also show the other half of in/out records')
+    ap.add_argument('-n', '--page-size', type=int, default=0)
+    ap.add_argument('--page', type=int, default=1, help='1 based, negative counts from the end')
+    ap.add_argument('--tail', type=int, help='only the last N records')
+    ap.add_argument('-f', '--follow', action='store_true')
+    ap.add_argument('-c', '--count', action='store_true', help='only count matching records')
+    ap.add_argument('--no-color', action='store_true')
+    ap.add_argument('--no-index', action='store_true', help="don't read or write the sidecar index")
+    opts = ap.parse_args(argv)
+
+    segments = [seg for seg in log_segments(opts.log) if seg != opts.log] if opts.all else []
+    views = [LogView(seg, use_index=not opts.no_index) for seg in segments + [opts.log]]
+    live = views[-1]
+    filters = dict(tag=opts.tag, func=opts.func, pid=opts.pid,
+                   since=opts.since, until=opts.until, grep=opts.grep)
+
+    def show(recs):
+        seen = set()
+        for lv, n in recs:
+            for i in (lv.with_pairs([n]) if opts.pair else [n]):
+                if (lv, i) in seen:
+                    continue
+                seen.add((lv, i))
+                text = lv.record(i)
+                if opts.no_color:
+                    text = EscCodes.sub('', text)
+                sys.stdout.write(text)
+        sys.stdout.flush()
+
+    recs = [(lv, n) for lv in views for n in lv.select(**filters)]
+    if opts.count:
+        print len(recs)
+        for lv in views:
+            lv.close()
+        return
+    if opts.tail is not None:
+        recs = recs[-opts.tail:] if opts.tail else []
+    if opts.page_size:
+        pages = max(1, (len(recs) + opts.page_size - 1) // opts.page_size)
+        page = opts.page if opts.page > 0 else pages + opts.page + 1
+        recs = recs[(page - 1) * opts.page_size:page * opts.page_size]
+    show(recs)
+
+    try:
+        while opts.follow:
+            time.sleep(0.25)
+            start = len(live.index)
+            new = live.refresh()
+            if len(live.index) != start or new < start:
+                show([(live, n) for n in live.select(start=new, **filters)])
+    except KeyboardInterrupt:
+        pass
+    for lv in views:
+        lv.close()
+
+####################################
+#
+#  collector for SocketSink
+#
+####################################
+
+class Collector(object):
+    """
+    The other end of SocketSink. Takes records from any number of
+    processes, holds them for `delay` seconds so they can be put in
+    time order, and writes them out in batches through a Writer.
+    """
+    def __init__(self, address='/tmp/cdb.sock', writer=None, delay=0.2, max_pending=10000):
+        self._address = address
+        self.writer = writer if writer is not None else Writer()
+        self._delay = delay
+        self._max_pending = max_pending
+        self._pending = []  # heap of (time, seq, record)
+        self._seq = 0
+        self._conns = {}    # socket -> unparsed bytes
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(1 << 16)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            # a half received frame is dropped, the client resends it
+            conn.close()
+            del self._conns[conn]
+            return
+        buf = self._conns[conn] + data
+        hsize = SocketSink.FRAME.size
+        pos = 0
+        while len(buf) - pos >= hsize:
+            t, pid, length = SocketSink.FRAME.unpack_from(buf, pos)
+            if len(buf) - pos - hsize < length:
+                break
+            start = pos + hsize
+            heapq.heappush(self._pending, (t, self._seq, buf[start:start + length]))
+            self._seq += 1
+            pos = start + length
+        self._conns[conn] = buf[pos:]
+
+    def flush(self, everything=False):
+        cutoff = time.time() - self._delay
+        out = []
+        while self._pending and (everything or self._pending[0][0] <= cutoff or
+                                 len(self._pending) > self._max_pending):
+            out.append(heapq.heappop(self._pending)[2])
+        if out:
+            self.writer.write_raw(''.join(out))
+
+    def serve(self):
+        if os.path.exists(self._address):
+            os.unlink(self._address)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self._address)
+        listener.listen(128)
+        listener.setblocking(0)
+        try:
+            while True:
+                ready = select.select([listener] + self._conns.keys(), [], [], self._delay)[0]
+                for s in ready:
+                    if s is listener:
+                        try:
+                            conn = listener.accept()[0]
+                        except socket.error:
+                            continue
+                        conn.setblocking(0)
+                        self._conns[conn] = ''
+                    else:
+                        self._read(s)
+                self.flush()
+        finally:
+            self.flush(everything=True)
+            listener.close()
+            for conn in self._conns:
+                conn.close()
+            if os.path.exists(self._address):
+                os.unlink(self._address)
+
+def collect_main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(prog='cdb.py collect', description='collect records from SocketSinks')
+    ap.add_argument('-s', '--socket', default='/tmp/cdb.sock')
+    ap.add_argument('-o', '--out', default='/tmp/cdb')
+    ap.add_argument('-d', '--delay', type=float, default=0.2,
+                    help='seconds records are held for ordering')
+    ap.add_argument('--max-bytes', type=int, default=0, help='rotate the output at this size')
+    ap.add_argument('--max-age', type=float, default=0, help='rotate the output after this many seconds')
+    ap.add_argument('--backups', type=int, default=5, help='rotated segments to keep')
+    ap.add_argument('--compress', choices=sorted(Compressors), help='compress rotated segments')
+    opts = ap.parse_args(argv)
+
+    def stop(*args):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        writer = Writer(opts.out, max_bytes=opts.max_bytes, max_age=opts.max_age,
+                        backups=opts.backups, compress=opts.compress)
+        Collector(opts.socket, writer, opts.delay).serve()
+    except KeyboardInterrupt:
+        pass
+
 
 #######
 # tests
@@ -764,4 +2157,9 @@ def test():
     edir(a)
 
 if __name__ == '__main__':
-    test()
+    if sys.argv[1:2] == ['view']:
+        view_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['collect']:
+        collect_main(sys.argv[2:])
+    else:
+        test()